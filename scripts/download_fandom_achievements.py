@@ -1,10 +1,13 @@
-import json
 import os
 import re
 from pathlib import Path
 
+import orjson
 import requests
-from bs4 import BeautifulSoup
+import requests_cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from lxml import etree, html as lh
 
 WIKI = "https://tibia.fandom.com"
 API_URL = f"{WIKI}/api.php"
@@ -17,6 +20,35 @@ HEADERS = {
     "Accept": "application/json,text/html,*/*",
 }
 
+_RE_WS = re.compile(r"\s+")
+_RE_INT = re.compile(r"-?\d+")
+
+def make_session() -> requests.Session:
+    """
+    Session with retry/backoff on 429/5xx (Retry-After is honoured).
+    The Achievements page response is cached on disk, so re-runs within a
+    day don't fetch it again.
+    """
+    s = requests_cache.CachedSession(
+        OUT_DIR / "http_cache.sqlite",
+        backend="sqlite",
+        cache_control=True,
+        expire_after=86400,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=32,
+        max_retries=Retry(
+            total=5,
+            backoff_factor=0.3,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["GET"],
+        ),
+    )
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    return s
+
 def api_parse_html(session: requests.Session, page_title: str) -> str:
     params = {
         "action": "parse",
@@ -28,49 +60,63 @@ def api_parse_html(session: requests.Session, page_title: str) -> str:
     r = session.get(API_URL, params=params, headers=HEADERS, timeout=60)
     r.raise_for_status()
     data = r.json()
-    html = ((data.get("parse", {}) or {}).get("text", {}) or {}).get("*")
+    try:
+        html = data["parse"]["text"]["*"]
+    except (KeyError, TypeError):
+        html = None
     if not html:
         raise RuntimeError(f"No HTML returned for page '{page_title}'")
     return html
 
 def norm(s: str) -> str:
-    return re.sub(r"\s+", " ", (s or "").strip().lower())
+    return _RE_WS.sub(" ", (s or "").strip().lower())
 
 def parse_int(s: str):
-    m = re.search(r"-?\d+", s or "")
+    m = _RE_INT.search(s or "")
     return int(m.group(0)) if m else None
 
+def node_text(el, sep: str = " ") -> str:
+    # lxml counterpart of BeautifulSoup's get_text(sep, strip=True)
+    return sep.join(t.strip() for t in el.itertext() if t.strip())
+
 def cell_text(cell) -> str:
     # Remove footnotes/superscripts if present, keep readable text
-    for sup in cell.find_all("sup"):
-        sup.decompose()
-    return re.sub(r"\s+", " ", cell.get_text(" ", strip=True))
-
-def find_achievements_table(soup: BeautifulSoup):
+    # Removing a <sup> merges its tail into the preceding text; keep the gap
+    # that get_text(" ") used to put there ("end<sup>1</sup>tail" -> "end tail")
+    for sup in cell.iter("sup"):
+        if sup.tail:
+            sup.tail = " " + sup.tail
+    etree.strip_elements(cell, "sup", with_tail=False)
+    return _RE_WS.sub(" ", node_text(cell))
+
+# Tables whose first row has a "Name" header cell, matched inside libxml2
+_ACHIEVEMENTS_TABLES_XPATH = (
+    "//table[(.//tr)[1]/th[normalize-space(translate(., "
+    "'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz'))='name']]"
+)
+
+def find_achievements_table(doc):
     """
     Find the big table that has headers like:
     Name | ID | Secret? | Grade | Points | Implemented | Description | Spoiler
     """
-    for table in soup.find_all("table"):
-        header_row = table.find("tr")
-        if not header_row:
-            continue
-        ths = header_row.find_all("th")
+    for table in doc.xpath(_ACHIEVEMENTS_TABLES_XPATH):
+        ths = table.xpath("(.//tr)[1]/th")
         if len(ths) < 5:
             continue
-        headers = [norm(th.get_text(" ", strip=True)) for th in ths]
+        headers = [norm(node_text(th)) for th in ths]
         # Must contain at least these core columns
         if "name" in headers and "grade" in headers and "points" in headers and "description" in headers:
             return table, headers
     return None, None
 
 def main():
-    s = requests.Session()
+    s = make_session()
     html = api_parse_html(s, "Achievements")
-    soup = BeautifulSoup(html, "html.parser")
+    doc = lh.fromstring(html)
 
-    table, headers = find_achievements_table(soup)
-    if not table:
+    table, headers = find_achievements_table(doc)
+    if table is None:
         raise RuntimeError("Could not find the Achievements list table. The page structure may have changed.")
 
     # Map header -> column index
@@ -86,17 +132,17 @@ def main():
     impl_i = idx.get("implemented")
 
     out = []
-    rows = table.find_all("tr")
+    rows = table.xpath(".//tr")
 
     for tr in rows[1:]:
-        tds = tr.find_all(["td", "th"])
+        tds = tr.xpath("./td | ./th")
         if not tds or len(tds) <= max(name_i, grade_i, points_i, desc_i):
             continue
 
         # Name: prefer the first link text inside the cell (usually the achievement page)
         name_cell = tds[name_i]
-        a = name_cell.find("a")
-        name = (a.get_text(strip=True) if a else cell_text(name_cell)).strip()
+        a = name_cell.find(".//a")
+        name = (node_text(a, "") if a is not None else cell_text(name_cell)).strip()
         if not name:
             continue
 
@@ -124,8 +170,8 @@ def main():
         out.append(item)
 
     out_path = OUT_DIR / "achievements.json"
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(out, f, ensure_ascii=False, indent=2)
+    with open(out_path, "wb") as f:
+        f.write(orjson.dumps(out, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
 
     print(f"Found achievements: {len(out)}")
     print(f"Wrote: {out_path}")
@@ -1,9 +1,15 @@
-import csv, json, os, re, time
+import csv, os, re, shutil, threading, time
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
+from queue import Queue
 from urllib.parse import urlparse
 
+import orjson
 import requests
-from bs4 import BeautifulSoup
+import requests_cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from bs4 import BeautifulSoup, SoupStrainer
 
 WIKI = "https://tibia.fandom.com"
 API  = f"{WIKI}/api.php"
@@ -16,11 +22,72 @@ HEADERS = {
     "Accept": "application/json,text/html,*/*",
 }
 
-SLEEP = 0.05
+class TokenBucket:
+    """
+    Thread-safe client-side rate limiter: allows bursts of up to `capacity`
+    requests, then refills at `refill_rate` tokens per second.
+    """
+
+    def __init__(self, capacity: float, refill_rate: float):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.refill_rate
+            time.sleep(wait)
+
+# Fandom API: short bursts, ~15 requests/sec sustained
+RATE_LIMIT = TokenBucket(capacity=10, refill_rate=15)
+COPY_CHUNK_SIZE = 1024 * 1024
+PARSE_WORKERS = 4
+DOWNLOAD_WORKERS = 16
+QUEUE_SIZE = 64
+PAGEIMAGES_BATCH_SIZE = 50
+
+_RE_WS = re.compile(r"\s+")
+_RE_SAFE = re.compile(r"[^\w\s\-\(\)\[\]\.]", re.UNICODE)
+
+def make_session() -> requests.Session:
+    """
+    Session with a connection pool big enough for concurrent fetches and
+    retry/backoff on 429/5xx (Retry-After is honoured). Responses are cached
+    on disk and revalidated with ETag/Last-Modified, so unchanged pages and
+    images cost next to nothing on re-runs.
+    """
+    s = requests_cache.CachedSession(
+        OUT_DIR / "http_cache.sqlite",
+        backend="sqlite",
+        cache_control=True,
+        expire_after=86400,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=32,
+        max_retries=Retry(
+            total=5,
+            backoff_factor=0.3,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["GET"],
+        ),
+    )
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    return s
 
 def safe_filename(name: str) -> str:
-    s = re.sub(r"[^\w\s\-\(\)\[\]\.]", "", name, flags=re.UNICODE)
-    s = re.sub(r"\s+", "_", s.strip())
+    s = _RE_SAFE.sub("", name)
+    s = _RE_WS.sub("_", s.strip())
     return s[:160] if s else "unknown"
 
 def api_get_category_members(session: requests.Session, category: str):
@@ -38,6 +105,7 @@ def api_get_category_members(session: requests.Session, category: str):
         }
         if cont:
             params["cmcontinue"] = cont
+        RATE_LIMIT.acquire()
         r = session.get(API, params=params, headers=HEADERS, timeout=60)
         r.raise_for_status()
         data = r.json()
@@ -45,25 +113,64 @@ def api_get_category_members(session: requests.Session, category: str):
         cont = (data.get("continue", {}) or {}).get("cmcontinue")
         if not cont:
             break
-        time.sleep(SLEEP)
     return members
 
 def api_parse_html(session: requests.Session, title: str) -> str:
     params = {"action": "parse", "format": "json", "page": title, "prop": "text", "redirects": 1}
+    RATE_LIMIT.acquire()
     r = session.get(API, params=params, headers=HEADERS, timeout=60)
     r.raise_for_status()
-    html = ((r.json().get("parse", {}) or {}).get("text", {}) or {}).get("*")
+    try:
+        html = r.json()["parse"]["text"]["*"]
+    except (KeyError, TypeError):
+        html = None
     if not html:
         raise RuntimeError(f"parse returned no html for {title}")
     return html
 
+def api_page_images(session: requests.Session, titles: list[str]) -> dict[str, str]:
+    """
+    Look up the original page image of up to 50 titles in one query
+    (prop=pageimages), so no article HTML has to be downloaded or parsed.
+    Titles without a page image are left out of the result.
+    """
+    params = {
+        "action": "query",
+        "format": "json",
+        "titles": "|".join(titles),
+        "prop": "pageimages",
+        "piprop": "original",
+        "pilimit": "max",
+        "redirects": 1,
+    }
+    RATE_LIMIT.acquire()
+    r = session.get(API, params=params, headers=HEADERS, timeout=60)
+    r.raise_for_status()
+    query = r.json().get("query", {})
+
+    # Map the API's normalized/redirected titles back to the ones we asked for
+    renamed = {m["from"]: m["to"] for m in query.get("normalized", []) + query.get("redirects", [])}
+    sources = {
+        page.get("title"): (page.get("original") or {}).get("source")
+        for page in query.get("pages", {}).values()
+    }
+
+    out = {}
+    for title in titles:
+        final = renamed.get(title, title)
+        final = renamed.get(final, final)
+        if sources.get(final):
+            out[title] = sources[final]
+    return out
+
 def choose_best_image_from_page(html: str) -> str | None:
     """
     Fandom pages often have a portable infobox image:
       <figure class="pi-item pi-image"> <img ... data-src="...">
     We'll try that first, else fall back to the first content image.
+    Only <figure>/<img> subtrees are built; the rest of the article is skipped.
     """
-    soup = BeautifulSoup(html, "html.parser")
+    soup = BeautifulSoup(html, "lxml", parse_only=SoupStrainer(["figure", "img"]))
 
     # 1) portable infobox image
     fig = soup.select_one("figure.pi-item.pi-image img")
@@ -96,43 +203,119 @@ def download(session: requests.Session, url: str, out_path: Path):
         if "image/" not in ct:
             raise RuntimeError(f"Not an image: {ct} from {url}")
         out_path.parent.mkdir(parents=True, exist_ok=True)
-        with open(out_path, "wb") as f:
-            for chunk in r.iter_content(1024 * 128):
-                if chunk:
-                    f.write(chunk)
+        r.raw.decode_content = True
+        # Replace rather than rewrite out_path, so a file hard-linked to it keeps its bytes.
+        tmp = out_path.with_name(out_path.name + ".part")
+        try:
+            with open(tmp, "wb") as f:
+                shutil.copyfileobj(r.raw, f, length=COPY_CHUNK_SIZE)
+            os.replace(tmp, out_path)
+        finally:
+            tmp.unlink(missing_ok=True)
+
+def resolve_image(session: requests.Session, title: str, jobs: Queue) -> None:
+    """
+    Fallback parser stage: fetch the mount page, pick its image and queue it for download.
+    """
+    try:
+        html = api_parse_html(session, title)
+        img_url = choose_best_image_from_page(html)
+        if img_url:
+            jobs.put((title, normalize_image_url(img_url)))
+    except Exception as e:
+        print("x", title, ":", e)
+
+def resolve_images(session: requests.Session, titles: list[str], jobs: Queue) -> None:
+    """
+    Parser stage: queue page images for a batch of mounts, parsing the page
+    HTML only for mounts the pageimages query has no image for.
+    """
+    try:
+        found = api_page_images(session, titles)
+    except Exception as e:
+        print("x pageimages batch", titles[0], "...", ":", e)
+        found = {}
+
+    for title in titles:
+        if title in found:
+            jobs.put((title, normalize_image_url(found[title])))
+        else:
+            resolve_image(session, title, jobs)
+
+def link_or_copy(src: Path, dst: Path):
+    """
+    Reuse an identical, already-saved image: hard link it, or copy where
+    links aren't supported.
+    """
+    if dst.exists() and dst.samefile(src):
+        return
+    tmp = dst.with_name(dst.name + ".part")
+    tmp.unlink(missing_ok=True)
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+def download_mount(session: requests.Session, title: str, img_url: str, first: Future | None = None) -> dict | None:
+    """
+    Download stage: save one mount image and return its index row.
+    `first` is the job for an earlier mount with the same img_url; its file
+    is reused instead of fetching the image again.
+    """
+    try:
+        ext = Path(urlparse(img_url).path).suffix or ".png"
+        filename = safe_filename(title) + ext
+        out_path = OUT_DIR / filename
+
+        prior = first.result() if first else None
+        if prior:
+            link_or_copy(OUT_DIR / prior["file"], out_path)
+        else:
+            download(session, img_url, out_path)
+        print("✓", title, "->", filename)
+        return {"name": title, "file": filename, "sourceUrl": img_url}
+    except Exception as e:
+        print("x", title, ":", e)
+        return None
 
 def main():
-    s = requests.Session()
+    s = make_session()
 
     members = api_get_category_members(s, "Category:Mounts")
     # Titles are pages like "War Bear", "Racing Bird", etc.
-    titles = [m["title"] for m in members if isinstance(m, dict) and m.get("title")]
-    titles.sort(key=lambda x: x.lower())
+    titles = [m["title"] for m in members]
+    titles.sort(key=str.lower)
 
     print(f"Found mounts in category: {len(titles)}")
 
-    out_items = []
-    for title in titles:
-        time.sleep(SLEEP)
-        try:
-            html = api_parse_html(s, title)
-            img_url = choose_best_image_from_page(html)
-            if not img_url:
-                continue
-            img_url = normalize_image_url(img_url)
-
-            ext = Path(urlparse(img_url).path).suffix or ".png"
-            filename = safe_filename(title) + ext
-            out_path = OUT_DIR / filename
-
-            download(s, img_url, out_path)
-            out_items.append({"name": title, "file": filename, "sourceUrl": img_url})
-            print("✓", title, "->", filename)
-        except Exception as e:
-            print("x", title, ":", e)
-
-    with open(OUT_DIR / "index.json", "w", encoding="utf-8") as f:
-        json.dump(out_items, f, ensure_ascii=False, indent=2)
+    # Image lookups and downloads (I/O) overlap: parser threads feed a bounded
+    # queue, a consumer thread hands each job to the download pool.
+    jobs: Queue = Queue(maxsize=QUEUE_SIZE)
+    downloads: dict[str, Future] = {}
+    by_url: dict[str, Future] = {}
+
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as dl_pool:
+        def consume():
+            while (job := jobs.get()) is not None:
+                title, img_url = job
+                fut = dl_pool.submit(download_mount, s, title, img_url, by_url.get(img_url))
+                by_url.setdefault(img_url, fut)
+                downloads[title] = fut
+
+        consumer = threading.Thread(target=consume)
+        consumer.start()
+        with ThreadPoolExecutor(max_workers=PARSE_WORKERS) as parse_pool:
+            for i in range(0, len(titles), PAGEIMAGES_BATCH_SIZE):
+                parse_pool.submit(resolve_images, s, titles[i:i + PAGEIMAGES_BATCH_SIZE], jobs)
+        jobs.put(None)
+        consumer.join()
+
+    # Collect in title order so index.json stays sorted
+    out_items = [item for item in (downloads[t].result() for t in titles if t in downloads) if item]
+
+    with open(OUT_DIR / "index.json", "wb") as f:
+        f.write(orjson.dumps(out_items, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
 
     with open(OUT_DIR / "index.csv", "w", newline="", encoding="utf-8") as f:
         w = csv.DictWriter(f, fieldnames=["name", "file", "sourceUrl"])
@@ -1,9 +1,13 @@
-import csv, json, os, re, time
+import csv, os, re, shutil, threading, time
 from pathlib import Path
 from urllib.parse import urlparse
 
+import orjson
 import requests
-from bs4 import BeautifulSoup
+import requests_cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from bs4 import BeautifulSoup, SoupStrainer
 
 WIKI = "https://tibia.fandom.com"
 API  = f"{WIKI}/api.php"
@@ -16,21 +20,81 @@ HEADERS = {
     "Accept": "application/json,text/html,*/*",
 }
 
-SLEEP = 0.05
+class TokenBucket:
+    """
+    Thread-safe client-side rate limiter: allows bursts of up to `capacity`
+    requests, then refills at `refill_rate` tokens per second.
+    """
+
+    def __init__(self, capacity: float, refill_rate: float):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.refill_rate
+            time.sleep(wait)
+
+# Fandom API: short bursts, ~15 requests/sec sustained
+RATE_LIMIT = TokenBucket(capacity=10, refill_rate=15)
+COPY_CHUNK_SIZE = 1024 * 1024
+
+_RE_WS = re.compile(r"\s+")
+_RE_SAFE = re.compile(r"[^\w\s\-\(\)\[\]\.]", re.UNICODE)
+
+def make_session() -> requests.Session:
+    """
+    Session with retry/backoff on 429/5xx (Retry-After is honoured).
+    The Outfits page and addon images are cached on disk, so re-runs within
+    a day don't fetch them again.
+    """
+    s = requests_cache.CachedSession(
+        OUT_DIR / "http_cache.sqlite",
+        backend="sqlite",
+        cache_control=True,
+        expire_after=86400,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=32,
+        max_retries=Retry(
+            total=5,
+            backoff_factor=0.3,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["GET"],
+        ),
+    )
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    return s
 
 def safe_filename(name: str) -> str:
-    s = re.sub(r"[^\w\s\-\(\)\[\]\.]", "", name, flags=re.UNICODE)
-    s = re.sub(r"\s+", "_", s.strip())
+    s = _RE_SAFE.sub("", name)
+    s = _RE_WS.sub("_", s.strip())
     return s[:160] if s else "unknown"
 
 def norm(s: str) -> str:
-    return re.sub(r"\s+", " ", (s or "").strip().lower())
+    return _RE_WS.sub(" ", (s or "").strip().lower())
 
 def api_parse_html(session: requests.Session, title: str) -> str:
     params = {"action": "parse", "format": "json", "page": title, "prop": "text", "redirects": 1}
+    RATE_LIMIT.acquire()
     r = session.get(API, params=params, headers=HEADERS, timeout=60)
     r.raise_for_status()
-    html = ((r.json().get("parse", {}) or {}).get("text", {}) or {}).get("*")
+    try:
+        html = r.json()["parse"]["text"]["*"]
+    except (KeyError, TypeError):
+        html = None
     if not html:
         raise RuntimeError(f"parse returned no html for {title}")
     return html
@@ -49,10 +113,30 @@ def download(session: requests.Session, url: str, out_path: Path):
         if "image/" not in ct:
             raise RuntimeError(f"Not an image: {ct} from {url}")
         out_path.parent.mkdir(parents=True, exist_ok=True)
-        with open(out_path, "wb") as f:
-            for chunk in r.iter_content(1024 * 128):
-                if chunk:
-                    f.write(chunk)
+        r.raw.decode_content = True
+        # Replace rather than rewrite out_path, so a file hard-linked to it keeps its bytes.
+        tmp = out_path.with_name(out_path.name + ".part")
+        try:
+            with open(tmp, "wb") as f:
+                shutil.copyfileobj(r.raw, f, length=COPY_CHUNK_SIZE)
+            os.replace(tmp, out_path)
+        finally:
+            tmp.unlink(missing_ok=True)
+
+def link_or_copy(src: Path, dst: Path):
+    """
+    Reuse an identical, already-saved image: hard link it, or copy where
+    links aren't supported.
+    """
+    if dst.exists() and dst.samefile(src):
+        return
+    tmp = dst.with_name(dst.name + ".part")
+    tmp.unlink(missing_ok=True)
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
 
 def find_outfits_table_and_male_addons_index(soup: BeautifulSoup):
     """
@@ -80,9 +164,10 @@ def find_outfits_table_and_male_addons_index(soup: BeautifulSoup):
     return None, None
 
 def main():
-    s = requests.Session()
+    s = make_session()
     html = api_parse_html(s, "Outfits")
-    soup = BeautifulSoup(html, "html.parser")
+    # Only the tables matter; don't build the rest of the article
+    soup = BeautifulSoup(html, "lxml", parse_only=SoupStrainer("table"))
 
     table, male_idx = find_outfits_table_and_male_addons_index(soup)
     if not table or male_idx is None:
@@ -130,8 +215,9 @@ def main():
     print(f"Found outfits with male addons image: {len(results)}")
 
     out_items = []
+    saved_by_url: dict[str, Path] = {}
     for item in results:
-        time.sleep(SLEEP)
+        RATE_LIMIT.acquire()
         name = item["name"]
         img_url = item["img_url"]
 
@@ -139,14 +225,19 @@ def main():
             ext = Path(urlparse(img_url).path).suffix or ".png"
             filename = safe_filename(name) + ext
             out_path = OUT_DIR / filename
-            download(s, img_url, out_path)
+            # Several outfits can share one image; fetch it only once
+            if img_url in saved_by_url:
+                link_or_copy(saved_by_url[img_url], out_path)
+            else:
+                download(s, img_url, out_path)
+                saved_by_url[img_url] = out_path
             out_items.append({"name": name, "file": filename, "sourceUrl": img_url})
             print("✓", name, "->", filename)
         except Exception as e:
             print("x", name, ":", e)
 
-    with open(OUT_DIR / "index.json", "w", encoding="utf-8") as f:
-        json.dump(out_items, f, ensure_ascii=False, indent=2)
+    with open(OUT_DIR / "index.json", "wb") as f:
+        f.write(orjson.dumps(out_items, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
 
     with open(OUT_DIR / "index.csv", "w", newline="", encoding="utf-8") as f:
         w = csv.DictWriter(f, fieldnames=["name", "file", "sourceUrl"])
@@ -1,16 +1,31 @@
-import json
 import os
 import re
+import shutil
+import threading
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from pathlib import Path
+from queue import Queue
 from urllib.parse import urlparse, unquote
 
 import cloudscraper
-from bs4 import BeautifulSoup
+import orjson
+import httpx
+from selectolax.lexbor import LexborHTMLParser
 
 WIKI_BASE = "https://www.tibiawiki.com.br"
 API_URL = f"{WIKI_BASE}/api.php"
-REQUEST_DELAY_SECONDS = 0.08
+PARSE_WORKERS = 4
+DOWNLOAD_WORKERS = 16
+QUEUE_SIZE = 64
+MW_BATCH_SIZE = 50
+COPY_CHUNK_SIZE = 1024 * 1024
+RETRY_STATUSES = {500, 502, 503, 504}
+RETRY_BACKOFF_SECONDS = 0.3
+
+_RE_EXT = re.compile(r"\.(gif|png)$", re.IGNORECASE)
 
 BOSSES_PAGE = f"{WIKI_BASE}/wiki/Bosses"
 
@@ -40,6 +55,36 @@ CREATURE_PAGES = [
 ]
 
 
+class TokenBucket:
+    """
+    Thread-safe client-side rate limiter: allows bursts of up to `capacity`
+    requests, then refills at `refill_rate` tokens per second.
+    """
+
+    def __init__(self, capacity: float, refill_rate: float):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.refill_rate
+            time.sleep(wait)
+
+
+# tibiawiki.com.br sits behind Cloudflare; keep it gentle
+RATE_LIMIT = TokenBucket(capacity=5, refill_rate=8)
+
+
 def desktop_path() -> Path:
     if os.name == "nt" and os.environ.get("USERPROFILE"):
         p = Path(os.environ["USERPROFILE"]) / "Desktop"
@@ -84,11 +129,54 @@ def build_fandom_gif_file(name: str) -> str | None:
     return f"{s2}.gif"
 
 
+def retry_after_seconds(r, default: float = 5.0) -> float:
+    """
+    Parse a Retry-After header (delta-seconds or HTTP-date).
+    """
+    value = (r.headers.get("Retry-After") or "").strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return default
+
+
+def retry_delay(r, attempt: int) -> float | None:
+    """
+    Seconds to wait before retrying response r, or None if it should not be retried.
+    429 honours Retry-After; transient 5xx back off exponentially.
+    """
+    if r.status_code == 429:
+        return retry_after_seconds(r)
+    if r.status_code in RETRY_STATUSES:
+        return RETRY_BACKOFF_SECONDS * (2 ** attempt)
+    return None
+
+
+def wiki_get(session, url: str, retries: int = 5, **kwargs):
+    """
+    GET a wiki page/API url through the rate limiter.
+    On 429 or a transient 5xx, wait (see retry_delay) and take a fresh token
+    before retrying.
+    """
+    for attempt in range(retries):
+        RATE_LIMIT.acquire()
+        r = session.get(url, **kwargs)
+        delay = retry_delay(r, attempt)
+        if delay is None:
+            return r
+        time.sleep(delay)
+    return r
+
+
 def fetch_html(scraper, url: str) -> str:
     """
     Try direct page; if blocked, fall back to API parse.
     """
-    r = scraper.get(url, timeout=60)
+    r = wiki_get(scraper, url, timeout=60)
     if r.status_code != 403:
         r.raise_for_status()
         return r.text
@@ -105,53 +193,115 @@ def fetch_html(scraper, url: str) -> str:
         "redirects": "1",
         "origin": "*",
     }
-    api_r = scraper.get(API_URL, params=params, timeout=60)
+    api_r = wiki_get(scraper, API_URL, params=params, timeout=60)
     api_r.raise_for_status()
     data = api_r.json()
-    html = (data.get("parse", {}).get("text", {}) or {}).get("*")
+    try:
+        html = data["parse"]["text"]["*"]
+    except (KeyError, TypeError):
+        html = None
     if not html:
         raise RuntimeError(f"Could not parse HTML for page '{title}'.")
     return html
 
 
-def mw_original_image_url(scraper, filename: str) -> str | None:
+def mw_original_image_urls_batch(session: httpx.Client, filenames: list[str], scraper=None) -> dict[str, str]:
     """
-    MediaWiki API lookup to get original file URL.
-    Tries Portuguese namespace 'Arquivo:' then 'File:' fallback.
+    Batched MediaWiki API lookup: filename -> original file URL.
+    Asks for up to MW_BATCH_SIZE titles per request, in the Portuguese
+    namespace 'Arquivo:' first and then 'File:' for whatever is still missing.
+    If Cloudflare answers 403 to the plain client, the batch is retried
+    through scraper (when given), which can pass the challenge.
     """
+    urls: dict[str, str] = {}
     for ns in ("Arquivo:", "File:"):
-        params = {
-            "action": "query",
-            "titles": f"{ns}{filename}",
-            "prop": "imageinfo",
-            "iiprop": "url",
-            "format": "json",
-            "origin": "*",
-        }
-        r = scraper.get(API_URL, params=params, timeout=60)
-        if r.status_code == 403:
-            return None
-        r.raise_for_status()
-        data = r.json()
+        missing = [n for n in dict.fromkeys(filenames) if n not in urls]
+        for i in range(0, len(missing), MW_BATCH_SIZE):
+            chunk = missing[i:i + MW_BATCH_SIZE]
+            params = {
+                "action": "query",
+                "titles": "|".join(f"{ns}{n}" for n in chunk),
+                "prop": "imageinfo",
+                "iiprop": "url",
+                "format": "json",
+                "origin": "*",
+            }
+            r = wiki_get(session, API_URL, params=params, timeout=60)
+            if r.status_code == 403 and scraper is not None:
+                r = wiki_get(scraper, API_URL, params=params, timeout=60)
+            if r.status_code == 403:
+                print(f"  imageinfo lookup blocked (403) for {len(chunk)} files in {ns}")
+                continue
+            r.raise_for_status()
+            query = r.json().get("query", {})
 
-        pages = data.get("query", {}).get("pages", {})
-        for _, page in pages.items():
-            ii = page.get("imageinfo")
-            if ii and isinstance(ii, list) and ii[0].get("url"):
-                return ii[0]["url"]
+            # The API reports titles it rewrote (underscores, first letter case)
+            normalized = {n["from"]: n["to"] for n in query.get("normalized", [])}
+            by_title = {}
+            for page in query.get("pages", {}).values():
+                ii = page.get("imageinfo")
+                if ii and isinstance(ii, list) and ii[0].get("url"):
+                    by_title[page.get("title")] = ii[0]["url"]
 
-        time.sleep(REQUEST_DELAY_SECONDS)
+            for n in chunk:
+                title = f"{ns}{n}"
+                url = by_title.get(normalized.get(title, title))
+                if url:
+                    urls[n] = url
 
-    return None
+    return urls
 
 
-def download(scraper, url: str, out_path: Path) -> None:
-    with scraper.get(url, stream=True, timeout=120) as r:
-        r.raise_for_status()
-        with open(out_path, "wb") as f:
-            for chunk in r.iter_content(chunk_size=1024 * 128):
-                if chunk:
-                    f.write(chunk)
+def save_image(r, chunks, url: str, out_path: Path) -> str | None:
+    """
+    Write an image response's body (chunks) to out_path.
+    Bytes go to a .part file that replaces out_path only once complete, so a
+    failed download keeps the previous sprite (and any hard link to it) intact.
+    Returns the new ETag ("" if the server sent none), or None on 304.
+    """
+    if r.status_code == 304:
+        return None
+    if r.status_code == 403:
+        print(f"  download blocked (403): {url}")
+    r.raise_for_status()
+    ct = (r.headers.get("content-type") or "").lower()
+    if "image/" not in ct:
+        raise RuntimeError(f"Not an image: {ct} from {url}")
+    tmp = out_path.with_name(out_path.name + ".part")
+    try:
+        with open(tmp, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(tmp, out_path)
+    finally:
+        tmp.unlink(missing_ok=True)
+    return r.headers.get("ETag") or ""
+
+
+def download(session: httpx.Client, url: str, out_path: Path, etag: str | None = None, retries: int = 5, scraper=None) -> str | None:
+    """
+    Stream url into out_path through the rate limiter (sprites live on the
+    same Cloudflare-protected host as the API), retrying 429/5xx like wiki_get().
+    With an etag, ask for If-None-Match and leave the existing file untouched on 304.
+    If Cloudflare answers 403 to the plain client, the download is retried
+    through scraper (when given), like mw_original_image_urls_batch().
+    Returns the new ETag ("" if the server sent none), or None if not modified.
+    """
+    headers = {"If-None-Match": etag} if etag else None
+    for attempt in range(retries):
+        RATE_LIMIT.acquire()
+        with session.stream("GET", url, headers=headers, timeout=120) as r:
+            if r.status_code == 403 and scraper is not None:
+                break
+            delay = retry_delay(r, attempt)
+            if delay is None:
+                return save_image(r, r.iter_bytes(COPY_CHUNK_SIZE), url, out_path)
+        time.sleep(delay)
+    else:
+        raise RuntimeError(f"Gave up after {retries} attempts (HTTP {r.status_code}): {url}")
+
+    with wiki_get(scraper, url, retries, headers=headers, stream=True, timeout=120) as r:
+        return save_image(r, r.iter_content(COPY_CHUNK_SIZE), url, out_path)
 
 
 def extract_name_and_wiki_file(html: str) -> list[tuple[str, str]]:
@@ -159,23 +309,23 @@ def extract_name_and_wiki_file(html: str) -> list[tuple[str, str]]:
     Extract (entity_name, wiki_filename) by scanning rows with an <img alt="X.gif/png">
     and a sensible first wiki link in the row.
     """
-    soup = BeautifulSoup(html, "html.parser")
+    tree = LexborHTMLParser(html)
     pairs: list[tuple[str, str]] = []
 
-    for tr in soup.find_all("tr"):
-        img = tr.find("img", alt=True)
-        if not img:
+    for tr in tree.css("tr"):
+        img = tr.css_first("img[alt]")
+        if img is None:
             continue
 
-        wiki_file = (img.get("alt") or "").strip()
-        if not re.search(r"\.(gif|png)$", wiki_file, re.IGNORECASE):
+        wiki_file = (img.attributes.get("alt") or "").strip()
+        if not _RE_EXT.search(wiki_file):
             continue
 
         chosen = None
-        for a in tr.find_all("a", href=True):
-            title = (a.get("title") or "").strip()
-            href = a["href"]
-            text = a.get_text(strip=True)
+        for a in tr.css("a[href]"):
+            title = (a.attributes.get("title") or "").strip()
+            href = a.attributes.get("href") or ""
+            text = a.text(strip=True)
 
             if not text:
                 continue
@@ -195,75 +345,225 @@ def extract_name_and_wiki_file(html: str) -> list[tuple[str, str]]:
     return pairs
 
 
-def run_group(scraper, group_name: str, page_urls: list[str], out_base: Path) -> None:
+def page_rows(scraper, url: str) -> list[dict]:
+    """
+    Parser stage: fetch one listing page and build an index row per sprite found.
+    """
+    html = fetch_html(scraper, url)
+    pairs = extract_name_and_wiki_file(html)
+    print(f"Fetched: {url} ({len(pairs)} rows)")
+
+    rows = []
+    for name, wiki_file in pairs:
+        fandom_file = build_fandom_gif_file(name)
+        if not fandom_file:
+            continue
+
+        rows.append({
+            "name": name,
+            "file": fandom_file,
+            "sourceWikiFile": wiki_file,
+            "sourceUrl": "",
+        })
+    return rows
+
+
+def fetch_sprite(session: httpx.Client, row: dict, out_path: Path, scraper=None) -> bool | None:
+    """
+    Download one index row's sprite from its resolved sourceUrl.
+    Sprites already on disk are only re-fetched, via a conditional GET, if an
+    ETag was stored by a previous run.
+    Returns True if downloaded, False if skipped, None if already up to date.
+    """
+    on_disk = out_path.exists() and out_path.stat().st_size > 0
+    if on_disk and not row["etag"]:
+        return None
+
+    if not row["sourceUrl"]:
+        return None if on_disk else False
+
+    try:
+        etag = download(session, row["sourceUrl"], out_path, row["etag"] if on_disk else None, scraper=scraper)
+    except Exception:
+        # The old sprite survives a failed download; without one, drop its stale ETag
+        if not on_disk:
+            row["etag"] = ""
+        return False
+
+    if etag is None:
+        return None
+    row["etag"] = etag
+    return True
+
+
+def name_key(name: str) -> str:
+    """
+    Canonical dedup key: link texts differ in spacing/case across category pages.
+    """
+    return " ".join(name.split()).lower()
+
+
+def link_sprite(first: Future, src: Path, out_path: Path) -> bool | None:
+    """
+    Save a sprite whose sourceUrl another row already fetched: wait for that
+    row's job, then hard link (or copy) its file instead of downloading again.
+    Returns True if saved, False if skipped, None if already on disk.
+    """
+    first.result()
+    if out_path.exists() and out_path.stat().st_size > 0:
+        return None
+    if not (src.exists() and src.stat().st_size > 0):
+        return False
+
+    try:
+        os.link(src, out_path)
+    except OSError:
+        try:
+            shutil.copyfile(src, out_path)
+        except OSError:
+            return False
+    return True
+
+
+def load_previous_index(path: Path) -> dict[str, dict]:
+    """
+    name_key -> row from an index.json written by an earlier run (empty if none).
+    """
+    try:
+        rows = orjson.loads(path.read_bytes())
+    except (OSError, orjson.JSONDecodeError):
+        return {}
+    return {name_key(row["name"]): row for row in rows if isinstance(row, dict) and row.get("name")}
+
+
+def run_group(scraper, session: httpx.Client, group_name: str, page_urls: list[str], out_base: Path) -> None:
     group_dir = out_base / group_name
     sprites_dir = group_dir
     ensure_dir(sprites_dir)
 
-    # name -> { name, file, sourceWikiFile, sourceUrl }
+    # name -> { name, file, sourceWikiFile, sourceUrl, etag }
     # file is the Fandom-style .gif filename you will host in GitHub
     index: dict[str, dict] = {}
+    out_index = group_dir / "index.json"
+    previous = load_previous_index(out_index)
 
     print(f"\n=== {group_name.upper()} ===")
-    for url in page_urls:
-        print(f"Fetching: {url}")
-        html = fetch_html(scraper, url)
-        pairs = extract_name_and_wiki_file(html)
-        print(f"  Found {len(pairs)} rows")
-
-        for name, wiki_file in pairs:
-            if name in index:
-                continue
-
-            fandom_file = build_fandom_gif_file(name)
-            if not fandom_file:
-                continue
-
-            index[name] = {
-                "name": name,
-                "file": fandom_file,
-                "sourceWikiFile": wiki_file,
-                "sourceUrl": "",
-            }
 
-        time.sleep(REQUEST_DELAY_SECONDS)
+    # Page parsing and sprite downloads overlap: parser threads fetch pages, their
+    # rows enter a bounded queue in page_urls order (so the first page listing a
+    # name still wins), and a single consumer thread dedups by name_key, resolves
+    # source URLs in batches and hands rows to the download pool. Download each
+    # sprite using TibiaWiki file, but SAVE AS your Fandom-style filename.
+    jobs: Queue = Queue(maxsize=QUEUE_SIZE)
+    futures: list[Future] = []
+    pending: list[dict] = []
+    seen_keys: set[str] = set()
+    # sourceUrl -> (job, file) of the first row using it; later rows reuse that file
+    by_url: dict[str, tuple[Future, Path]] = {}
+
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as dl_pool:
+        def submit(row: dict) -> None:
+            out_path = sprites_dir / row["file"]
+            first = by_url.get(row["sourceUrl"])
+            if first:
+                futures.append(dl_pool.submit(link_sprite, *first, out_path))
+                return
+
+            fut = dl_pool.submit(fetch_sprite, session, row, out_path, scraper)
+            if row["sourceUrl"]:
+                by_url[row["sourceUrl"]] = (fut, out_path)
+            futures.append(fut)
+
+        def flush() -> None:
+            try:
+                urls = mw_original_image_urls_batch(
+                    session, [row["sourceWikiFile"] for row in pending], scraper
+                )
+            except Exception as e:
+                print(f"  imageinfo lookup failed for {len(pending)} files: {e}")
+                urls = {}
+            for row in pending:
+                row["sourceUrl"] = urls.get(row["sourceWikiFile"], "")
+                submit(row)
+            pending.clear()
+
+        def consume():
+            while (row := jobs.get()) is not None:
+                key = name_key(row["name"])
+                if key in seen_keys:
+                    continue
+                seen_keys.add(key)
+                index[row["name"]] = row
+
+                prev = previous.get(key, {})
+                row["etag"] = prev.get("etag") or ""
+
+                # Sprites already on disk reuse the previous run's sourceUrl
+                out_path = sprites_dir / row["file"]
+                if prev.get("sourceUrl") and out_path.exists() and out_path.stat().st_size > 0:
+                    row["sourceUrl"] = prev["sourceUrl"]
+                    submit(row)
+                    continue
+
+                pending.append(row)
+                if len(pending) >= MW_BATCH_SIZE:
+                    flush()
+            flush()
+
+        consumer = threading.Thread(target=consume)
+        consumer.start()
+        try:
+            with ThreadPoolExecutor(max_workers=PARSE_WORKERS) as parse_pool:
+                for fut in [parse_pool.submit(page_rows, scraper, url) for url in page_urls]:
+                    for row in fut.result():
+                        jobs.put(row)
+        finally:
+            jobs.put(None)
+            consumer.join()
 
     print(f"Total unique {group_name}: {len(index)}")
 
     downloaded = 0
     skipped = 0
-
-    # Download each sprite using TibiaWiki file, but SAVE AS your Fandom-style filename.
-    for name, row in sorted(index.items(), key=lambda x: x[0].lower()):
-        time.sleep(REQUEST_DELAY_SECONDS)
-
-        src_url = mw_original_image_url(scraper, row["sourceWikiFile"])
-        row["sourceUrl"] = src_url or ""
-
-        out_path = sprites_dir / row["file"]
-        if out_path.exists() and out_path.stat().st_size > 0:
-            continue
-
-        if not src_url:
-            skipped += 1
-            continue
-
-        try:
-            download(scraper, src_url, out_path)
+    for fut in futures:
+        result = fut.result()
+        if result is True:
             downloaded += 1
-        except Exception:
+        elif result is False:
             skipped += 1
 
     # Write index.json (array is easier for JS)
-    out_index = group_dir / "index.json"
-    with open(out_index, "w", encoding="utf-8") as f:
-        json.dump(list(index.values()), f, ensure_ascii=False, indent=2)
+    with open(out_index, "wb") as f:
+        rows = sorted(index.values(), key=lambda row: row["name"].lower())
+        f.write(orjson.dumps(rows, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
 
     print(f"Saved: {group_dir}")
     print(f"Downloaded: {downloaded} | Skipped: {skipped}")
     print(f"Index: {out_index}")
 
 
+def make_session(scraper) -> httpx.Client:
+    """
+    HTTP/2 client carrying the scraper's Cloudflare clearance cookies and
+    headers, for the bulk API/image traffic once clearance is obtained.
+    Concurrent lookups and downloads are multiplexed over a few connections
+    and cloudscraper's per-request challenge detection stays off the hot
+    path; 429s are still handled by wiki_get().
+    """
+    transport = httpx.HTTPTransport(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=32, max_connections=32),
+        retries=3,
+    )
+    return httpx.Client(
+        headers=dict(scraper.headers),
+        cookies=scraper.cookies,
+        timeout=60.0,
+        follow_redirects=True,
+        transport=transport,
+    )
+
+
 def main():
     out_base = desktop_path() / "TibiaSprites"
     ensure_dir(out_base)
@@ -272,14 +572,14 @@ def main():
         browser={"browser": "chrome", "platform": "windows", "desktop": True}
     )
     scraper.get(WIKI_BASE + "/", timeout=60)
-
-    run_group(scraper, "bosses", [BOSSES_PAGE], out_base)
-    run_group(scraper, "creatures", CREATURE_PAGES, out_base)
+    with make_session(scraper) as session:
+        run_group(scraper, session, "bosses", [BOSSES_PAGE], out_base)
+        run_group(scraper, session, "creatures", CREATURE_PAGES, out_base)
 
     print("\nAll done.")
     print(f"Output root: {out_base}")
 
 
 if __name__ == "__main__":
-    # pip install cloudscraper beautifulsoup4
+    # pip install cloudscraper selectolax orjson httpx[http2]
     main()
\ No newline at end of file